@@ -1,33 +1,102 @@
+import importlib.util
 import os
+
+
+def resolve_async_mode():
+    """
+    确定Socket.IO的异步模式：优先使用SOCKETIO_ASYNC_MODE，未设置时与Flask-SocketIO相同，
+    依次选择已安装的eventlet、gevent，都未安装时使用threading。
+    """
+    mode = os.environ.get('SOCKETIO_ASYNC_MODE')
+    if mode:
+        return mode
+    for candidate in ('eventlet', 'gevent'):
+        if importlib.util.find_spec(candidate) is not None:
+            return candidate
+    return 'threading'
+
+
+# Set SOCKETIO_ASYNC_MODE to "threading", "eventlet" or "gevent" to test the
+# different async modes, or leave it unset for the application to choose
+# the best option based on installed packages.
+# eventlet和gevent需要在导入其他模块之前替换标准库中的阻塞实现，
+# 否则消息队列的监听等阻塞调用会阻塞整个事件循环
+async_mode = resolve_async_mode()
+if async_mode == 'eventlet':
+    import eventlet
+
+    eventlet.monkey_patch()
+elif async_mode == 'gevent':
+    from gevent import monkey
+
+    monkey.patch_all()
+
+import json
 import tempfile
 import uuid
+import zipfile
+import zlib
 
-from flask import Flask, request, session
+import requests
+from flask import Flask, Response, request, session, stream_with_context
 from flask import jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, Namespace, emit, disconnect
 
 from business.xunfei import FaceCompareClient, FaceFeatureClient, SparkAPI
-from services.authentication import authenticate_face
-from services.recognition import recognize_faces, rename_face
+from services.authentication import authenticate_face, AuthenticationSession
+from services.comparison import compare_faces
+from services.recognition import recognize_faces, rename_face, search_faces_batch
 from services.registration import register_face
-from utils.face_detection import find_primary_face
+from utils.face_detection import find_primary_face, find_primary_face_in_roi
 from utils.face_quality import is_face_forward
-from utils.image_processing import parse_frame_data
+from utils.face_storage import FACE_GALLERY_PATH, get_face_storage, load_gallery
+from utils.frame_cache import CachedFrame, FrameCache
+from utils.gallery_sync import KombuGalleryBus, gallery_sync
+from utils.image_processing import decode_image_bytes, parse_frame_data
+from utils.score_calibration import is_low_confidence
+from utils.wire_format import CompactFaceEncoder, pack_face
 
-# Set this variable to "threading", "eventlet" or "gevent" to test the
-# different async modes, or leave it set to None for the application to choose
-# the best option based on installed packages.
-async_mode = None
+# 多进程或多节点部署时设置为消息队列地址（如redis://localhost:6379/0），
+# 用于跨进程发送Socket.IO消息和同步人脸库变更；各节点前的负载均衡需要开启会话保持
+message_queue = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+
+# 加载已保存的人脸库，例如批量注册生成的文件
+if os.path.exists(FACE_GALLERY_PATH):
+    load_gallery(get_face_storage(), FACE_GALLERY_PATH)
 
 app = Flask(__name__)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode, message_queue=message_queue)
+
+# 开始监听后会向其他节点请求全部人脸条目，补上本节点启动前的变更；
+# 运行期间的变更不会写回FACE_GALLERY_PATH，见GallerySync
+if message_queue:
+    gallery_sync.start(get_face_storage(), KombuGalleryBus(message_queue), socketio.start_background_task)
 
 # 配置上传文件夹和允许的扩展
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# 批量检索的限制：压缩包的条目数、单个条目解压后的大小和每张图像返回的候选人数
+MAX_ARCHIVE_ENTRIES = 10000
+MAX_ARCHIVE_ENTRY_SIZE = 20 * 1024 * 1024
+MAX_TOP_K = 20
+# 人脸比对模式：local为本地比对，remote为始终调用讯飞服务
+app.config['FACE_COMPARE_MODE'] = os.environ.get('FACE_COMPARE_MODE', 'local')
+# 本地比对未检测到人脸或结果不够可靠时是否回退到讯飞服务
+app.config['FACE_COMPARE_FALLBACK'] = os.environ.get('FACE_COMPARE_FALLBACK', 'true').lower() == 'true'
+
+
+def run_blocking(func, *args, **kwargs):
+    """在线程池中执行CPU密集的推理，避免阻塞eventlet或gevent的事件循环"""
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    elif socketio.async_mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
 
 
 # Utility function to check allowed file
@@ -45,7 +114,29 @@ def secure_filename(filename):
     return safe_filename
 
 
+def compare_faces_remote(file1, file2):
+    """调用讯飞人脸比对服务，返回(code, data)"""
+    # 使用临时文件
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filepath1 = os.path.join(tmpdirname, secure_filename(file1.filename))
+        filepath2 = os.path.join(tmpdirname, secure_filename(file2.filename))
+
+        file1.stream.seek(0)
+        file2.stream.seek(0)
+        file1.save(filepath1)
+        file2.save(filepath2)
+
+        # 调用人脸比对服务，离线时视为请求错误
+        client = FaceCompareClient()
+        try:
+            return client.compare_faces(filepath1, filepath2)
+        except requests.RequestException:
+            return -1, '请求错误'
+
+
 # 讯飞API - 人脸比对
+# FACE_COMPARE_MODE为local时优先在本地比对，仅在未检测到人脸或分数接近阈值且开启FACE_COMPARE_FALLBACK时调用讯飞服务；
+# 返回的source字段说明分数来自本地（local，经calibrate_score换算）还是讯飞服务（remote）
 @app.route('/api/xunfei/face-compare', methods=['POST'])
 def face_compare():
     # 检查是否上传了两个文件
@@ -58,22 +149,28 @@ def face_compare():
     elif not allowed_file(file1.filename) or not allowed_file(file2.filename):
         return jsonify({'error': '文件类型不正确'}), 400
 
-    # 使用临时文件
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        filepath1 = os.path.join(tmpdirname, secure_filename(file1.filename))
-        filepath2 = os.path.join(tmpdirname, secure_filename(file2.filename))
-
-        file1.save(filepath1)
-        file2.save(filepath2)
-
-        # 调用人脸比对服务
-        client = FaceCompareClient()
-        code, data = client.compare_faces(filepath1, filepath2)
-
+    score, message = None, None
+    fallback = app.config['FACE_COMPARE_FALLBACK']
+    if app.config['FACE_COMPARE_MODE'] == 'local':
+        image1 = decode_image_bytes(file1.read())
+        image2 = decode_image_bytes(file2.read())
+        if image1 is None or image2 is None:
+            return jsonify({'error': '无法解码图像'}), 400
+        score, message = run_blocking(compare_faces, image1, image2)
+        if score is not None and not (fallback and is_low_confidence(score)):
+            return jsonify({'message': '比对成功', 'data': score, 'source': 'local'}), 200
+        if not fallback:
+            return jsonify({'error': message}), 400
+
+    code, data = compare_faces_remote(file1, file2)
     if code == 0:
-        return jsonify({'message': '比对成功', 'data': data}), 200
+        return jsonify({'message': '比对成功', 'data': data, 'source': 'remote'}), 200
+    elif score is not None:
+        # 讯飞服务不可用时仍返回本地结果
+        return jsonify({'message': '比对成功', 'data': score, 'source': 'local'}), 200
     else:
-        return jsonify({'error': data}), 400
+        # 本地未检测到人脸时返回本地的原因，而不是讯飞服务的请求错误
+        return jsonify({'error': message or data}), 400
 
 
 # 讯飞API - 人脸特征分析
@@ -99,12 +196,86 @@ def face_features():
     return jsonify(result)
 
 
+def iter_uploaded_images(files, archive):
+    """
+    逐张读取并解码上传的图像和压缩包中的图像，产出(文件名, PIL.Image, 错误消息)。
+
+    单张图像读取或解码失败时图像为None并给出错误消息，不会中断整个响应。
+    """
+    for file in files:
+        if file.filename == '' or not allowed_file(file.filename):
+            yield file.filename, None, "文件类型不正确"
+        else:
+            yield file.filename, decode_image_bytes(file.read()), None
+    if archive is not None:
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or not allowed_file(info.filename):
+                    continue
+                if info.file_size > MAX_ARCHIVE_ENTRY_SIZE:
+                    yield info.filename, None, "文件过大"
+                    continue
+                try:
+                    image_bytes = archive.read(info)
+                except (zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError, EOFError) as e:
+                    # 加密、损坏或使用不支持的压缩方式的条目
+                    yield info.filename, None, f"无法读取压缩包条目: {e}"
+                    continue
+                yield info.filename, decode_image_bytes(image_bytes), None
+
+
+# 本地人脸库 - 批量1:N检索，结果以NDJSON逐行流式返回
+@app.route('/api/face-recognition/batch', methods=['POST'])
+def face_search_batch():
+    files = request.files.getlist('images')
+    archive_file = request.files.get('archive')
+    if not files and archive_file is None:
+        return jsonify({'error': '缺少文件参数'}), 400
+    try:
+        top_k = int(request.form.get('top_k', 1))
+    except ValueError:
+        top_k = None
+    if top_k is None or not 1 <= top_k <= MAX_TOP_K:
+        return jsonify({'error': f'top_k应为1到{MAX_TOP_K}之间的整数'}), 400
+
+    archive = None
+    if archive_file is not None:
+        # 在开始流式响应前检查压缩包，避免在返回200之后才发现错误
+        try:
+            archive = zipfile.ZipFile(archive_file.stream)
+        except zipfile.BadZipFile:
+            return jsonify({'error': '文件类型不正确'}), 400
+        if len(archive.infolist()) > MAX_ARCHIVE_ENTRIES:
+            archive.close()
+            return jsonify({'error': f'压缩包中的文件数超过{MAX_ARCHIVE_ENTRIES}'}), 400
+
+    def generate():
+        for result in search_faces_batch(iter_uploaded_images(files, archive), top_k=top_k, run=run_blocking):
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 # 人脸认证的命名空间
 class FaceAuthNamespace(Namespace):
-    def on_connect(self):
+    def __init__(self, namespace=None, roi_detection=True):
+        super().__init__(namespace)
+        self.roi_detection = roi_detection  # 是否只在上一帧人脸附近检测
+        self.login_sessions = {}  # request.sid -> AuthenticationSession
+        self.frame_cache = FrameCache()  # 最近一帧预览的检测结果，供登录和注册复用
+        self.compact_clients = set()  # 协商了紧凑二进制格式的连接
+
+    def on_connect(self, auth=None):
+        # 客户端在连接时通过auth或查询参数format=compact选择紧凑二进制格式，默认为JSON
+        wire_format = (auth or {}).get('format') or request.args.get('format')
+        if wire_format == 'compact':
+            self.compact_clients.add(request.sid)
         print("Client connected to Face Auth")
 
     def on_disconnect(self):
+        self.compact_clients.discard(request.sid)
+        self.login_sessions.pop(request.sid, None)
+        self.frame_cache.pop(request.sid)
         print("Client disconnected from Face Auth")
 
     def on_frame(self, data):
@@ -115,33 +286,55 @@ class FaceAuthNamespace(Namespace):
             return
         image = parse_frame_data(image_data)
 
-        primary_face = find_primary_face(image)
+        # 上一帧检测到人脸时只在其附近区域检测，人脸丢失后缓存被清除，回退到全图检测
+        cached_frame = self.frame_cache.get(request.sid) if self.roi_detection else None
+        if cached_frame is not None:
+            primary_face = run_blocking(find_primary_face_in_roi, image, cached_frame.primary_face[0])
+        else:
+            primary_face = run_blocking(find_primary_face, image)
         if primary_face:
             box, prob, landmark = primary_face
 
-            if is_face_forward(landmark):
+            is_forward = is_face_forward(landmark)
+            self.frame_cache.put(request.sid, CachedFrame(image, primary_face, is_forward))
+            if is_forward:
                 left, top, right, bottom = box
                 location = (top, right, bottom, left)
-                result = {'success': True, 'face': {'location': location, 'landmark': landmark.tolist()},
-                          'timestamp': timestamp}
+                if request.sid in self.compact_clients:
+                    face = pack_face(location, landmark)
+                else:
+                    face = {'location': location, 'landmark': landmark.tolist()}
+                result = {'success': True, 'face': face, 'timestamp': timestamp}
             else:
                 result = {'success': False, 'message': "人脸质量不符合要求或非正脸", 'timestamp': timestamp}
         else:
+            self.frame_cache.pop(request.sid)
             result = {'success': False, 'message': "未检测到人脸", 'timestamp': timestamp}
 
         emit('detection_result', result)
 
+    def _get_cached_encoding(self):
+        # 优先复用最近一帧预览的人脸编码，避免重新解码、检测和编码
+        cached_frame = self.frame_cache.get(request.sid)
+        if cached_frame is not None:
+            return run_blocking(cached_frame.get_encoding)
+        return None
+
     def on_register(self, data):
         """
         处理用户注册事件。
         """
         image_data = data['image']
         username = data['username']
-        if image_data.endswith('data:,'):
+        face_encoding = self._get_cached_encoding()
+        if face_encoding is not None:
+            success, message = run_blocking(register_face, None, username, face_encoding=face_encoding)
+            result = {'success': success, 'message': message}
+        elif image_data.endswith('data:,'):
             result = {'success': False, 'message': "帧数据为空"}
         else:
             image = parse_frame_data(image_data)
-            success, message = register_face(image, username)
+            success, message = run_blocking(register_face, image, username)
             result = {'success': success, 'message': message}
 
         emit('register_response', result)
@@ -151,19 +344,52 @@ class FaceAuthNamespace(Namespace):
         处理用户登录事件。
         """
         image_data = data['image']
-        if image_data.endswith('data:,'):
+        face_encoding = self._get_cached_encoding()
+        if face_encoding is not None:
+            success, message = run_blocking(authenticate_face, None, face_encoding=face_encoding)
+            result = {'success': success, 'message': message}
+        elif image_data.endswith('data:,'):
             print('Empty frame data')
             result = {'success': False, 'message': "帧数据为空"}
         else:
             image = parse_frame_data(image_data)
-            success, message = authenticate_face(image)
+            success, message = run_blocking(authenticate_face, image)
             result = {'success': success, 'message': message}
 
         emit('login_response', result)
 
+    def on_login_start(self, data=None):
+        """
+        开始多帧流式登录，之后的帧通过login_frame事件发送。
+        """
+        self.login_sessions[request.sid] = AuthenticationSession.from_options(data)
+
+    def on_login_frame(self, data):
+        """
+        处理流式登录的一帧，认证成功或用完预算时发送login_response，否则发送login_progress。
+        """
+        login_session = self.login_sessions.get(request.sid)
+        if login_session is None:
+            login_session = self.login_sessions[request.sid] = AuthenticationSession()
+
+        image_data = data['image']
+        if image_data.endswith('data:,'):
+            print('Empty frame data')
+            return
+        image = parse_frame_data(image_data)
+        finished, success, message = run_blocking(login_session.add_frame, image)
+        if finished:
+            self.login_sessions.pop(request.sid, None)
+            emit('login_response', {'success': success, 'message': message})
+        else:
+            emit('login_progress', {'frames': login_session.frame_count, 'message': message})
+
 
 # 实时人脸识别的命名空间
 class FaceRecognitionNamespace(Namespace):
+    def __init__(self, namespace=None):
+        super().__init__(namespace)
+        self.compact_encoders = {}  # request.sid -> CompactFaceEncoder，仅协商了紧凑格式的连接
 
     def on_disconnect_request(self):
         emit('my_response',
@@ -180,19 +406,32 @@ class FaceRecognitionNamespace(Namespace):
         image = parse_frame_data(image_data)
 
         # 在这里调用你的人脸检测逻辑
-        faces = recognize_faces(image)
-        emit('detection_results', {'faces': faces, 'timestamp': timestamp})
+        faces = run_blocking(recognize_faces, image)
+        encoder = self.compact_encoders.get(request.sid)
+        if encoder is not None:
+            emit('detection_results', encoder.encode(faces, timestamp))
+        else:
+            emit('detection_results', {'faces': faces, 'timestamp': timestamp})
 
     def on_rename_face(self, data):
-        # TODO: 增加对重命名结果的处理
         face_id = data['id']
         name = data['name']
-        rename_face(face_id, name)
-
-    def on_connect(self):
+        renamed, message = rename_face(face_id, name)
+        if renamed:
+            result = {'success': True, 'id': face_id, 'name': name}
+        else:
+            result = {'success': False, 'id': face_id, 'message': message}
+        emit('rename_response', result)
+
+    def on_connect(self, auth=None):
+        # 客户端在连接时通过auth或查询参数format=compact选择紧凑二进制格式，默认为JSON
+        wire_format = (auth or {}).get('format') or request.args.get('format')
+        if wire_format == 'compact':
+            self.compact_encoders[request.sid] = CompactFaceEncoder()
         print("Client connected to Face Recognition")
 
     def on_disconnect(self):
+        self.compact_encoders.pop(request.sid, None)
         print('Client disconnected from Face Recognition', request.sid)
 
 
@@ -236,4 +475,18 @@ socketio.on_namespace(FaceRecognitionNamespace('/api/face-recognition'))
 socketio.on_namespace(ChatNamespace('/api/chat'))
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True, allow_unsafe_werkzeug=True)
+    import argparse
+
+    # 多进程部署时每个进程使用不同端口启动，并设置相同的SOCKETIO_MESSAGE_QUEUE
+    parser = argparse.ArgumentParser(description='启动人脸识别服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--debug', action='store_true', help='使用Werkzeug开发服务器并开启调试模式和自动重载')
+    args = parser.parse_args()
+
+    if args.debug:
+        socketio.run(app, host=args.host, port=args.port, debug=True, allow_unsafe_werkzeug=True)
+    elif socketio.async_mode == 'threading':
+        parser.error('生产模式需要eventlet或gevent，请安装production依赖（poetry install -E production）或使用--debug')
+    else:
+        socketio.run(app, host=args.host, port=args.port)
@@ -0,0 +1,45 @@
+import argparse
+import os
+import time
+
+from services.enrollment import bulk_enroll, face_storage, list_sources
+from utils.face_storage import FACE_GALLERY_PATH, load_gallery
+
+
+def print_progress(stats):
+    elapsed = time.monotonic() - stats['started_at']
+    rate = stats['processed'] / elapsed if elapsed > 0 else 0
+    print(f"\r已处理 {stats['processed']}/{stats['total']}，成功 {stats['accepted']}，"
+          f"拒绝 {stats['rejected']}，{rate:.1f} 张/秒", end='', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线批量注册人脸')
+    parser.add_argument('source', help='照片目录或CSV清单（每行为照片路径,用户名）')
+    parser.add_argument('--gallery', default=FACE_GALLERY_PATH, help='人脸库文件路径')
+    parser.add_argument('--state', help='断点续传状态文件路径，默认为人脸库路径加.state.json')
+    parser.add_argument('--rejections', default='rejections.csv', help='被拒绝照片的报告路径')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4, help='解码线程数')
+    parser.add_argument('--queue-size', type=int, default=256, help='解码队列的最大长度')
+    parser.add_argument('--max-size', type=int, default=1024, help='照片缩放后的最大边长')
+    args = parser.parse_args()
+
+    if os.path.exists(args.gallery):
+        load_gallery(face_storage, args.gallery)
+
+    sources = list_sources(args.source)
+    stats = bulk_enroll(sources,
+                        gallery_path=args.gallery,
+                        state_path=args.state or f"{args.gallery}.state.json",
+                        rejections_path=args.rejections,
+                        batch_size=args.batch_size,
+                        workers=args.workers,
+                        queue_size=args.queue_size,
+                        max_size=args.max_size,
+                        progress=print_progress)
+    print(f"\n完成：共 {stats['total']} 张，成功 {stats['accepted']}，拒绝 {stats['rejected']}")
+
+
+if __name__ == '__main__':
+    main()
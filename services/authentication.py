@@ -1,33 +1,129 @@
+import time
+
 from utils.face_detection import find_primary_face, align_face
 from utils.face_encoding import encode_face
 from utils.face_quality import evaluate_face_quality
-from utils.face_storage import FaceStorage
+from utils.face_storage import get_face_storage
 
-face_storage = FaceStorage()
+face_storage = get_face_storage()
 
+# 流式登录会话的帧数和时间上限，客户端请求的值会被限制在此范围内
+MAX_LOGIN_FRAMES = 30
+MAX_LOGIN_TIMEOUT = 15.0
 
-def authenticate_face(image):
-    """
-    对给定的图像进行人脸认证。
 
-    参数:
-    - image: 包含用户人脸的图像（PIL.Image格式）。
+def _encode_primary_face(image):
+    """
+    检测图像中最显著的人脸并编码，未通过检测或质量检查的帧不会进行编码。
 
     返回:
-    - 认证成功与否的布尔值以及相应的消息。
+    - 人脸编码以及失败时的消息，成功时消息为None。
     """
     primary_face = find_primary_face(image)
     if primary_face:
         box, prob, landmark = primary_face
         if evaluate_face_quality(box, prob, image, landmark):
             aligned_face = align_face(image, box, landmark)
-            face_encoding = encode_face(aligned_face)
-            matched_face = face_storage.match_face(face_encoding)
-            if matched_face:
-                return True, matched_face['name']
-            else:
-                return False, "认证失败，未知人脸，请先注册"
+            return encode_face(aligned_face), None
         else:
-            return False, "人脸质量不符合要求"
+            return None, "人脸质量不符合要求"
+    else:
+        return None, "未检测到人脸"
+
+
+def authenticate_face(image, face_encoding=None):
+    """
+    对给定的图像进行人脸认证。
+
+    参数:
+    - image: 包含用户人脸的图像（PIL.Image格式）。
+    - face_encoding: 已计算好的人脸编码，提供时跳过检测和编码。
+
+    返回:
+    - 认证成功与否的布尔值以及相应的消息。
+    """
+    if face_encoding is None:
+        face_encoding, message = _encode_primary_face(image)
+        if face_encoding is None:
+            return False, message
+    matched_face = face_storage.match_face(face_encoding)
+    if matched_face:
+        return True, matched_face['name']
     else:
-        return False, "未检测到人脸"
+        return False, "认证失败，未知人脸，请先注册"
+
+
+class AuthenticationSession:
+    """
+    多帧流式人脸认证会话。
+
+    客户端连续发送帧，每帧的匹配结果按身份累计置信度，
+    某个身份的累计置信度达到阈值时立即认证成功；
+    超过帧数或时间预算仍未达到阈值时认证失败。
+    """
+
+    def __init__(self, confidence_threshold=0.5, max_frames=10, timeout=5.0, tolerance=0.6):
+        self.confidence_threshold = confidence_threshold
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self.tolerance = tolerance
+        self.started_at = time.monotonic()
+        self.frame_count = 0
+        self.evidence = {}  # 人脸ID -> 累计置信度
+        self.message = "未检测到人脸"
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        根据客户端提供的选项创建会话，max_frames和timeout转换为数值并限制在服务端上限内，无效时使用默认值。
+        """
+        options = options if isinstance(options, dict) else {}
+        try:
+            max_frames = int(options.get('max_frames', 10))
+        except (TypeError, ValueError, OverflowError):
+            max_frames = 10
+        try:
+            timeout = float(options.get('timeout', 5.0))
+        except (TypeError, ValueError):
+            timeout = 5.0
+        if timeout != timeout:  # NaN
+            timeout = 5.0
+        return cls(max_frames=min(max(max_frames, 1), MAX_LOGIN_FRAMES),
+                   timeout=min(max(timeout, 0.1), MAX_LOGIN_TIMEOUT))
+
+    def is_exhausted(self):
+        """是否已用完帧数或时间预算"""
+        return self.frame_count >= self.max_frames or time.monotonic() - self.started_at >= self.timeout
+
+    def add_frame(self, image):
+        """
+        处理一帧图像并累计认证证据。
+
+        参数:
+        - image: 包含用户人脸的图像（PIL.Image格式）。
+
+        返回:
+        - (finished, success, message)：会话是否结束、认证是否成功以及相应的消息。
+        """
+        self.frame_count += 1
+        face_encoding, message = _encode_primary_face(image)
+        if face_encoding is None:
+            self.message = message
+        else:
+            results = face_storage.search_faces(face_encoding, k=1)
+            if results and results[0][0] < self.tolerance:
+                distance, face = results[0]
+                # 距离越小，该帧提供的置信度越高
+                confidence = self.evidence.get(face['id'], 0) + 1 - distance / self.tolerance
+                self.evidence[face['id']] = confidence
+                if confidence >= self.confidence_threshold:
+                    return True, True, face['name']
+                self.message = "认证中，请保持正对摄像头"
+            else:
+                self.message = "认证失败，未知人脸，请先注册"
+
+        if self.is_exhausted():
+            if self.evidence:
+                self.message = "认证失败，置信度不足"
+            return True, False, self.message
+        return False, False, self.message
@@ -0,0 +1,26 @@
+import numpy as np
+
+from utils.face_detection import find_primary_faces, align_face
+from utils.face_encoding import encode_faces
+from utils.score_calibration import calibrate_score
+
+
+def compare_faces(image1, image2):
+    """
+    在本地比对两张图像中最显著的人脸。
+
+    参数:
+    - image1, image2: 包含人脸的图像（PIL.Image格式）。
+
+    返回:
+    - 相似度分数以及失败时的消息；未检测到人脸时分数为None。
+    """
+    images = [image1, image2]
+    primary_faces = find_primary_faces(images)
+    if any(primary_face is None for primary_face in primary_faces):
+        return None, "未检测到人脸"
+
+    aligned_faces = [align_face(image, box, landmark) for image, (box, prob, landmark) in zip(images, primary_faces)]
+    face_encoding1, face_encoding2 = encode_faces(aligned_faces)
+    distance = np.linalg.norm(face_encoding1 - face_encoding2)
+    return calibrate_score(distance), None
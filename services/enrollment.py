@@ -0,0 +1,215 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from utils.face_detection import find_primary_faces, align_face
+from utils.face_encoding import encode_faces
+from utils.face_quality import is_face_forward, evaluate_face_quality
+from utils.face_storage import FaceGallery, get_face_storage, resolve_enrollment, save_gallery
+
+face_storage = get_face_storage()
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp'}
+
+
+def list_sources(source):
+    """
+    列出待注册的照片。
+
+    参数:
+    - source: 照片目录或CSV清单。目录中直接存放的照片以文件名作为用户名，
+              子目录中的照片以子目录名作为用户名；CSV清单每行为(照片路径, 用户名)。
+
+    返回:
+    - (照片路径, 用户名)列表。
+    """
+    if os.path.isfile(source):
+        base_dir = os.path.dirname(source)
+        with open(source, newline='', encoding='utf-8') as f:
+            return [(os.path.join(base_dir, row[0]), row[1]) for row in csv.reader(f) if len(row) >= 2]
+
+    sources = []
+    for dirpath, _, filenames in os.walk(source):
+        for filename in sorted(filenames):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            name = stem if os.path.samefile(dirpath, source) else os.path.basename(dirpath)
+            sources.append((os.path.join(dirpath, filename), name))
+    return sources
+
+
+def _decode_image(path, max_size):
+    image = Image.open(path).convert('RGB')
+    # 缩小过大的照片以降低检测开销
+    image.thumbnail((max_size, max_size))
+    return image
+
+
+def _decode_stage(sources, decoded_queue, workers, max_size, stop_event):
+    """并行解码照片，按原顺序放入有界队列，队列满时阻塞"""
+
+    def put(item):
+        path, name, future = item
+        try:
+            decoded_queue.put((path, name, future.result(), None))
+        except Exception as e:
+            decoded_queue.put((path, name, None, f"无法解码图像: {e}"))
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for path, name in sources:
+            if stop_event.is_set():
+                break
+            pending.append((path, name, executor.submit(_decode_image, path, max_size)))
+            if len(pending) >= workers * 2:
+                put(pending.popleft())
+        while pending and not stop_event.is_set():
+            put(pending.popleft())
+    decoded_queue.put(None)
+
+
+def _iter_batches(decoded_queue, batch_size):
+    batch = []
+    while True:
+        item = decoded_queue.get()
+        if item is None:
+            break
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _enroll_batch(batch, enroll_tolerance):
+    """
+    对一批解码后的照片进行检测、对齐、编码、去重并批量写入人脸库。
+
+    返回:
+    - 成功注册的数量以及被拒绝的(照片路径, 用户名, 原因)列表。
+    """
+    rejected = []
+    decoded = []
+    for path, name, image, error in batch:
+        if image is None:
+            rejected.append((path, name, error))
+        else:
+            decoded.append((path, name, image))
+
+    candidates = []
+    aligned_faces = []
+    # 照片缩小后尺寸各不相同，填充到同一尺寸后才能真正批量检测
+    primary_faces = find_primary_faces([image for _, _, image in decoded], pad=True)
+    for (path, name, image), primary_face in zip(decoded, primary_faces):
+        if primary_face is None:
+            rejected.append((path, name, "未检测到人脸"))
+            continue
+        box, prob, landmark = primary_face
+        if not (is_face_forward(landmark) and evaluate_face_quality(box, prob, image, landmark)):
+            rejected.append((path, name, "人脸质量不符合要求或非正脸"))
+            continue
+        candidates.append((path, name))
+        aligned_faces.append(align_face(image, box, landmark))
+
+    # 本批新增的人脸先放在临时人脸库中，用于批内去重，最后一次性写入；
+    # 去重规则与register_face相同，同时考虑人脸库和本批已处理的照片
+    batch_gallery = FaceGallery()
+    accepted = 0
+    for (path, name), face_encoding in zip(candidates, encode_faces(aligned_faces)):
+        gallery, face, message = resolve_enrollment((face_storage, batch_gallery), face_encoding, name,
+                                                    enroll_tolerance=enroll_tolerance)
+        if message is not None:
+            rejected.append((path, name, message))
+            continue
+        if face is None:
+            batch_gallery.add_known_face(face_encoding, name)
+        else:
+            gallery.update_face_encoding(face['id'], face_encoding)
+        accepted += 1
+
+    face_storage.add_faces(batch_gallery.get_all_faces())
+    return accepted, rejected
+
+
+def _load_state(state_path):
+    """读取已处理的照片集合和被拒绝照片的列表"""
+    if state_path and os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        return set(state['processed']), [tuple(row) for row in state['rejected']]
+    return set(), []
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def bulk_enroll(sources, gallery_path=None, state_path=None, rejections_path=None, batch_size=32, workers=4,
+                queue_size=256, max_size=1024, checkpoint_every=10, enroll_tolerance=0.9, progress=None):
+    """
+    离线批量注册人脸。
+
+    照片在线程池中并行解码后进入有界队列，再按批进行检测和编码，
+    与人脸库去重后批量写入。每checkpoint_every批保存一次人脸库、已处理的照片列表和拒绝报告，
+    中断后使用同一个state_path重新运行会跳过已处理的照片，上次检查点之后的照片会重新处理。
+
+    参数:
+    - sources: (照片路径, 用户名)列表，见list_sources。
+    - gallery_path: 人脸库文件路径，为None时不保存。
+    - state_path: 已处理照片列表的保存路径，为None时不支持断点续传。
+    - rejections_path: 被拒绝照片的CSV报告路径，每行为(照片路径, 用户名, 原因)，在每个检查点重写。
+    - enroll_tolerance: 见register_face。
+    - progress: 每批处理完成后以统计信息字典调用的回调函数。
+
+    返回:
+    - 统计信息字典，包括total、processed、accepted和rejected。
+    """
+    processed, rejections = _load_state(state_path)
+    remaining = [(path, name) for path, name in sources if path not in processed]
+    stats = {'total': len(sources), 'processed': len(sources) - len(remaining), 'accepted': 0, 'rejected': 0,
+             'started_at': time.monotonic()}
+
+    decoded_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    decoder = threading.Thread(target=_decode_stage, args=(remaining, decoded_queue, workers, max_size, stop_event),
+                               daemon=True)
+    decoder.start()
+
+    def checkpoint():
+        # 拒绝报告只由已保存到状态文件的内容生成，续传时不会重复写入
+        if gallery_path:
+            save_gallery(face_storage, gallery_path)
+        if state_path:
+            _write_atomic(state_path, lambda f: json.dump(
+                {'processed': sorted(processed), 'rejected': rejections}, f, ensure_ascii=False))
+        if rejections_path:
+            _write_atomic(rejections_path, lambda f: csv.writer(f).writerows(rejections))
+
+    try:
+        for batch_count, batch in enumerate(_iter_batches(decoded_queue, batch_size), start=1):
+            accepted, rejected = _enroll_batch(batch, enroll_tolerance)
+            rejections.extend(rejected)
+            processed.update(path for path, _, _, _ in batch)
+            stats['processed'] += len(batch)
+            stats['accepted'] += accepted
+            stats['rejected'] += len(rejected)
+            if batch_count % checkpoint_every == 0:
+                checkpoint()
+            if progress:
+                progress(stats)
+        checkpoint()
+    finally:
+        stop_event.set()
+    return stats
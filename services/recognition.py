@@ -1,11 +1,14 @@
 import numpy as np
 
-from utils.face_detection import find_faces, align_face
-from utils.face_encoding import encode_face
+from utils.face_detection import find_faces, find_primary_faces, align_face
+from utils.face_encoding import encode_face, encode_faces
 from utils.face_quality import is_face_forward, evaluate_face_quality
-from utils.face_storage import FaceStorage
+from utils.face_storage import get_face_storage, resolve_enrollment
+from utils.gallery_sync import gallery_sync
+from utils.unknown_faces import UnknownFacePool
 
-face_storage = FaceStorage()
+face_storage = get_face_storage()
+unknown_faces = UnknownFacePool()
 last_faces = []
 last_face_boxes = []
 
@@ -55,13 +58,16 @@ def recognize_faces(image):
                 face_encoding = encode_face(aligned_face)
                 face = face_storage.match_face(face_encoding)
                 if face is None:
-                    face = face_storage.add_known_face(face_encoding, "未知")
+                    # 未知人脸不进入人脸库，避免人脸库被临时人脸撑大
+                    face = unknown_faces.match_or_add(face_encoding)
             else:
                 face = {'id': None, 'name': "忽略"}
 
             faces.append(face)
     else:
         faces = last_faces
+        # 沿用上一帧结果时不会重新匹配，需要刷新未知人脸的出现时间
+        unknown_faces.touch(face['id'] for face in faces if face['id'] is not None)
 
     last_face_boxes = boxes
     last_faces = faces
@@ -84,4 +90,113 @@ def recognize_faces(image):
 
 
 def rename_face(face_id, name):
-    face_storage.rename_face(face_id, name)
+    """
+    重命名人脸，未知人脸池中的临时身份在重命名后转入人脸库。
+
+    与注册相同，每个用户名只对应一个身份：临时身份按resolve_enrollment的规则
+    并入同名身份或以原ID新建身份，不符合规则时拒绝；已知身份不能重命名为其他身份的用户名。
+
+    返回:
+    - 是否重命名成功以及失败时的消息。
+    """
+    unknown_face = unknown_faces.get(face_id)
+    if unknown_face is None:
+        existing_face = face_storage.find_face_by_name(name)
+        if existing_face is not None and existing_face['id'] != face_id:
+            return False, "用户名已被注册"
+        if not face_storage.rename_face(face_id, name):
+            return False, "人脸不存在或已过期"
+        # 分片人脸库返回的是副本，沿用上一帧的识别结果不会随之更新，需要在这里同步名称
+        for face in last_faces:
+            if face['id'] == face_id:
+                face['name'] = name
+        gallery_sync.publish_renamed(face_id, name)
+        return True, None
+
+    _, face, message = resolve_enrollment((face_storage,), unknown_face['encoding'], name)
+    if message is not None:
+        return False, message
+    if unknown_faces.pop(face_id) is None:
+        return False, "人脸不存在或已过期"
+
+    templates = unknown_face['templates']
+    if face is None:
+        unknown_face['name'] = name
+        face_storage.add_known_face(templates[0], name, face_id=face_id)
+        for face_encoding in templates[1:]:
+            face_storage.update_face_encoding(face_id, face_encoding)
+        gallery_sync.publish_added(unknown_face)
+    else:
+        for face_encoding in templates:
+            face_storage.update_face_encoding(face['id'], face_encoding)
+            gallery_sync.publish_updated(face['id'], face_encoding)
+        # 画面中沿用的识别结果引用同一个字典，直接改为已有身份
+        unknown_face['id'] = face['id']
+        unknown_face['name'] = name
+    return True, None
+
+
+def _search_batch(batch, top_k, tolerance):
+    results = [None] * len(batch)
+    detected = [i for i, (_, image, _) in enumerate(batch) if image is not None]
+    for i, (filename, image, error) in enumerate(batch):
+        if image is None:
+            results[i] = {'filename': filename, 'success': False, 'message': error or "无法解码图像"}
+
+    indices = []
+    aligned_faces = []
+    locations = []
+    primary_faces = find_primary_faces([batch[i][1] for i in detected])
+    for i, primary_face in zip(detected, primary_faces):
+        filename, image, _ = batch[i]
+        if primary_face is None:
+            results[i] = {'filename': filename, 'success': False, 'message': "未检测到人脸"}
+            continue
+        box, prob, landmark = primary_face
+        left, top, right, bottom = box
+        indices.append(i)
+        aligned_faces.append(align_face(image, box, landmark))
+        locations.append((float(top), float(right), float(bottom), float(left)))
+
+    for i, location, face_encoding in zip(indices, locations, encode_faces(aligned_faces)):
+        candidates = [{'id': face['id'], 'name': face['name'], 'distance': distance}
+                      for distance, face in face_storage.search_faces(face_encoding, k=top_k)]
+        matched = bool(candidates) and candidates[0]['distance'] < tolerance
+        results[i] = {
+            'filename': batch[i][0],
+            'success': True,
+            'matched': matched,
+            'name': candidates[0]['name'] if matched else None,
+            'location': location,
+            'candidates': candidates
+        }
+    return results
+
+
+def search_faces_batch(images, batch_size=32, top_k=1, tolerance=0.6, run=None):
+    """
+    对多张图像中最显著的人脸进行1:N检索，按批检测和编码，每处理完一批就逐张产出结果。
+
+    参数:
+    - images: 可迭代的(文件名, 图像, 错误消息)，图像为PIL.Image格式；无法读取或解码时图像为None，
+              错误消息说明原因。
+    - batch_size: 每批处理的图像数量。
+    - top_k: 每张图像返回的候选人数量。
+    - tolerance: 判定为匹配的最大距离。
+    - run: 以run(func, *args)的形式执行每批的检测和编码，例如放入线程池；为None时直接调用。
+
+    返回:
+    - 生成器，按输入顺序产出每张图像的结果字典。
+    """
+    if run is None:
+        def run(func, *args):
+            return func(*args)
+
+    batch = []
+    for item in images:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield from run(_search_batch, batch, top_k, tolerance)
+            batch = []
+    if batch:
+        yield from run(_search_batch, batch, top_k, tolerance)
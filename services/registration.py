@@ -1,36 +1,59 @@
 from utils.face_detection import find_primary_face, align_face
 from utils.face_encoding import encode_face
 from utils.face_quality import is_face_forward, evaluate_face_quality
-from utils.face_storage import FaceStorage
+from utils.face_storage import get_face_storage, resolve_enrollment
+from utils.gallery_sync import gallery_sync
 
-face_storage = FaceStorage()
+face_storage = get_face_storage()
 
 
-def register_face(image, username):
+def _encode_forward_face(image):
     """
-    注册新的用户人脸。
-
-    参数:
-    - image: 包含用户人脸的图像（PIL.Image格式）。
-    - username: 用户的名称。
+    检测图像中最显著的正脸并编码。
 
     返回:
-    - 成功或失败的消息。
+    - 人脸编码以及失败时的消息，成功时消息为None。
     """
     primary_face = find_primary_face(image)
     if primary_face:
         box, prob, landmark = primary_face
         if is_face_forward(landmark) and evaluate_face_quality(box, prob, image, landmark):
             aligned_face = align_face(image, box, landmark)
-            face_encoding = encode_face(aligned_face)
-            matched_face = face_storage.match_face(face_encoding)
-            if matched_face is None:
-                face = face_storage.add_known_face(face_encoding, username)
-                face_id = face['id']
-                return True, username
-            else:
-                return False, "人脸已注册"
+            return encode_face(aligned_face), None
         else:
-            return False, "人脸质量不符合要求或非正脸"
+            return None, "人脸质量不符合要求或非正脸"
+    else:
+        return None, "未检测到人脸"
+
+
+def register_face(image, username, enroll_tolerance=0.9, face_encoding=None):
+    """
+    注册新的用户人脸。
+
+    同一用户重复注册时，新的人脸编码作为该用户的模板加入，而不是新建一个身份。
+
+    参数:
+    - image: 包含用户人脸的图像（PIL.Image格式）。
+    - username: 用户的名称。
+    - enroll_tolerance: 未匹配时，与同名用户已有模板的距离低于此值才会作为新模板加入。
+    - face_encoding: 已计算好的正脸编码，提供时跳过检测和编码。
+
+    返回:
+    - 成功或失败的消息。
+    """
+    if face_encoding is None:
+        face_encoding, message = _encode_forward_face(image)
+        if face_encoding is None:
+            return False, message
+
+    gallery, face, message = resolve_enrollment((face_storage,), face_encoding, username,
+                                                enroll_tolerance=enroll_tolerance)
+    if message is not None:
+        return False, message
+    if face is None:
+        face = face_storage.add_known_face(face_encoding, username)
+        gallery_sync.publish_added(face)
     else:
-        return False, "未检测到人脸"
+        face_storage.update_face_encoding(face['id'], face_encoding)
+        gallery_sync.publish_updated(face['id'], face_encoding)
+    return True, username
@@ -0,0 +1,12 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def make_encodings():
+    """生成n个512维的随机人脸特征，同一seed的结果相同"""
+
+    def make(n, seed=0):
+        return np.random.default_rng(seed).normal(size=(n, 512)).astype(np.float32)
+
+    return make
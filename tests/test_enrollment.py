@@ -0,0 +1,94 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from services import enrollment
+from utils.face_storage import FaceGallery, load_gallery
+
+# 灰度为0的照片视为没有人脸，其他照片的编码由灰度决定，灰度相同即为同一个人
+NO_FACE = 0
+
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    """用按像素值生成结果的函数替换检测和编码模型，并记录编码过的照片"""
+    encoded = []
+
+    def find_primary_faces(images, pad=False):
+        assert pad
+        return [None if image.getpixel((0, 0))[0] == NO_FACE else
+                (np.array([0, 0, image.width, image.height]), 0.99, np.zeros((5, 2))) for image in images]
+
+    def encode_faces(face_images):
+        values = [face_image.getpixel((0, 0))[0] for face_image in face_images]
+        encoded.extend(values)
+        return [np.random.default_rng(value).normal(size=512).astype(np.float32) for value in values]
+
+    monkeypatch.setattr(enrollment, 'find_primary_faces', find_primary_faces)
+    monkeypatch.setattr(enrollment, 'encode_faces', encode_faces)
+    monkeypatch.setattr(enrollment, 'align_face', lambda image, box, landmark: image)
+    monkeypatch.setattr(enrollment, 'is_face_forward', lambda landmark: True)
+    monkeypatch.setattr(enrollment, 'evaluate_face_quality', lambda box, prob, image, landmark: True)
+    monkeypatch.setattr(enrollment, 'face_storage', FaceGallery())
+    return encoded
+
+
+def make_sources(tmp_path, photos):
+    """photos为(灰度, 用户名)列表，照片尺寸各不相同"""
+    sources = []
+    for i, (value, name) in enumerate(photos):
+        path = str(tmp_path / f"{i}.png")
+        Image.new('RGB', (40 + i, 50), (value, value, value)).save(path)
+        sources.append((path, name))
+    return sources
+
+
+def run(sources, tmp_path, **kwargs):
+    return enrollment.bulk_enroll(sources,
+                                  gallery_path=str(tmp_path / 'gallery.npz'),
+                                  state_path=str(tmp_path / 'state.json'),
+                                  rejections_path=str(tmp_path / 'rejections.csv'),
+                                  batch_size=2, workers=1, checkpoint_every=1, **kwargs)
+
+
+def read_rejections(tmp_path):
+    with open(tmp_path / 'rejections.csv', newline='', encoding='utf-8') as f:
+        return [tuple(row) for row in csv.reader(f)]
+
+
+def test_batch_deduplicates_and_reports_rejections(stub_models, tmp_path):
+    sources = make_sources(tmp_path, [(10, 'a'), (10, 'a'), (NO_FACE, 'b'), (20, 'c'), (20, 'd')])
+    stats = run(sources, tmp_path)
+    assert (stats['processed'], stats['accepted'], stats['rejected']) == (5, 3, 2)
+
+    storage = enrollment.face_storage
+    assert sorted(face['name'] for face in storage.get_all_faces()) == ['a', 'c']
+    assert [(path, reason) for path, _, reason in read_rejections(tmp_path)] == [
+        (sources[2][0], "未检测到人脸"), (sources[4][0], "人脸已注册")]
+
+
+def test_resume_skips_processed_photos_and_keeps_report(stub_models, monkeypatch, tmp_path):
+    sources = make_sources(tmp_path, [(NO_FACE, 'a'), (10, 'b'), (20, 'c'), (NO_FACE, 'd')])
+
+    def interrupt(stats):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run(sources, tmp_path, progress=interrupt)
+    with open(tmp_path / 'state.json', encoding='utf-8') as f:
+        assert sorted(json.load(f)['processed']) == sorted(path for path, _ in sources[:2])
+
+    # 模拟重新启动：从保存的人脸库文件加载
+    storage = FaceGallery()
+    load_gallery(storage, tmp_path / 'gallery.npz')
+    monkeypatch.setattr(enrollment, 'face_storage', storage)
+    stub_models.clear()
+    stats = run(sources, tmp_path)
+
+    assert stub_models == [20]
+    assert (stats['processed'], stats['accepted'], stats['rejected']) == (4, 1, 1)
+    assert sorted(face['name'] for face in storage.get_all_faces()) == ['b', 'c']
+    assert [path for path, _, _ in read_rejections(tmp_path)] == [sources[0][0], sources[3][0]]
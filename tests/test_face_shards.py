@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from utils.face_shards import ShardedFaceStorage
+from utils.face_storage import SingletonMeta
+
+
+@pytest.fixture
+def storage():
+    storage = ShardedFaceStorage(3)
+    yield storage
+    storage.close()
+    SingletonMeta._instances.pop(ShardedFaceStorage, None)
+
+
+def test_search_merges_results_from_all_shards(storage):
+    ids = [storage.add_known_face(np.full(4, i, dtype=np.float32), str(i))['id'] for i in range(6)]
+    results = storage.search_faces(np.full(4, 2, dtype=np.float32), k=3)
+    assert results[0][1]['name'] == '2'
+    assert {face['name'] for _, face in results[1:]} == {'1', '3'}
+    assert storage.get_face_info(ids[4])['name'] == '4'
+
+
+def test_failed_broadcast_does_not_leave_stale_replies(storage):
+    face_id = storage.add_known_face(np.ones(4, dtype=np.float32), 'a')['id']
+    with pytest.raises(ValueError):
+        storage.search_faces(np.zeros(3))
+    assert storage.get_face_info(face_id)['name'] == 'a'
+    assert storage.rename_face(face_id, 'b')
+    assert storage.find_face_by_name('b')['id'] == face_id
@@ -0,0 +1,104 @@
+import numpy as np
+
+from utils.face_storage import FaceGallery, load_gallery, resolve_enrollment, save_gallery
+
+
+def test_search_returns_nearest_identities_in_order(make_encodings):
+    gallery = FaceGallery()
+    encodings = make_encodings(20)
+    for i, encoding in enumerate(encodings):
+        gallery.add_known_face(encoding, str(i))
+    results = gallery.search_faces(encodings[7] + 0.01, k=3)
+    assert results[0][1]['name'] == '7'
+    assert [distance for distance, _ in results] == sorted(distance for distance, _ in results)
+
+
+def test_update_adds_templates_and_tracks_centroid(make_encodings):
+    gallery = FaceGallery(max_templates=3)
+    encodings = make_encodings(3)
+    face = gallery.add_known_face(encodings[0], 'a')
+    gallery.search_faces(encodings[0])  # 构建质心矩阵
+    gallery.update_face_encoding(face['id'], encodings[1])
+    gallery.update_face_encoding(face['id'], encodings[2])
+    assert len(face['templates']) == 3
+    np.testing.assert_allclose(face['encoding'], encodings.mean(axis=0), atol=1e-5)
+    np.testing.assert_allclose(gallery._get_centroids()[0], face['encoding'])
+    assert gallery.match_face(encodings[2])['id'] == face['id']
+
+
+def test_update_replaces_template_farthest_from_centroid_when_full(make_encodings):
+    gallery = FaceGallery(max_templates=2)
+    base = make_encodings(1)[0]
+    face = gallery.add_known_face(base, 'a')
+    gallery.update_face_encoding(face['id'], base + 1.0)
+    gallery.update_face_encoding(face['id'], base + 0.1)
+    assert len(face['templates']) == 2
+    templates = np.asarray(face['templates'])
+    np.testing.assert_allclose(face['encoding'], templates.mean(axis=0), atol=1e-5)
+
+
+def test_rename_updates_name_lookup(make_encodings):
+    gallery = FaceGallery()
+    face = gallery.add_known_face(make_encodings(1)[0], 'a')
+    assert gallery.rename_face(face['id'], 'b')
+    assert gallery.find_face_by_name('a') is None
+    assert gallery.find_face_by_name('b') is face
+
+
+def test_resolve_enrollment_uses_all_galleries(make_encodings):
+    storage, batch = FaceGallery(), FaceGallery()
+    encodings = make_encodings(3)
+    stored = storage.add_known_face(encodings[0], 'a')
+
+    # 同一个人，匹配到同名身份
+    assert resolve_enrollment((storage, batch), encodings[0] + 0.01, 'a') == (storage, stored, None)
+    # 匹配到其他身份
+    assert resolve_enrollment((storage, batch), encodings[0] + 0.01, 'b')[2] == "人脸已注册"
+    # 未匹配，但与同名身份距离在enroll_tolerance内
+    close = encodings[0] + 0.7 / np.sqrt(512)
+    assert resolve_enrollment((storage, batch), close, 'a', tolerance=0.6) == (storage, stored, None)
+    # 未匹配且与同名身份距离过远
+    assert resolve_enrollment((storage, batch), encodings[1], 'a')[2] == "用户名已被注册"
+    # 新身份，以及在另一个人脸库中找到的同名身份
+    assert resolve_enrollment((storage, batch), encodings[1], 'c') == (None, None, None)
+    pending = batch.add_known_face(encodings[2], 'c')
+    assert resolve_enrollment((storage, batch), encodings[2] + 0.01, 'c') == (batch, pending, None)
+
+
+def test_save_and_load_round_trip(tmp_path, make_encodings):
+    gallery = FaceGallery()
+    encodings = make_encodings(3)
+    face = gallery.add_known_face(encodings[0], '张三')
+    gallery.update_face_encoding(face['id'], encodings[1])
+    gallery.add_known_face(encodings[2], 'b')
+    path = tmp_path / 'gallery.npz'
+    save_gallery(gallery, path)
+
+    loaded = FaceGallery()
+    load_gallery(loaded, path)
+    restored = loaded.get_face_info(face['id'])
+    assert restored['name'] == '张三'
+    assert len(restored['templates']) == 2
+    np.testing.assert_allclose(restored['encoding'], face['encoding'])
+    assert loaded.find_face_by_name('b') is not None
+    assert loaded.match_face(encodings[1])['id'] == face['id']
+
+
+def test_save_and_load_empty_gallery(tmp_path):
+    path = tmp_path / 'gallery.npz'
+    save_gallery(FaceGallery(), path)
+    loaded = FaceGallery()
+    load_gallery(loaded, path)
+    assert loaded.get_all_faces() == []
+
+
+def test_update_skips_near_duplicate_templates(make_encodings):
+    gallery = FaceGallery(max_templates=2)
+    encodings = make_encodings(2)
+    face = gallery.add_known_face(encodings[0], 'a')
+    gallery.update_face_encoding(face['id'], encodings[1])
+    # 模板已满时重复提交的编码不会替换其他模板
+    assert gallery.update_face_encoding(face['id'], encodings[1] + 0.001)
+    assert len(face['templates']) == 2
+    np.testing.assert_array_equal(face['templates'][0], encodings[0])
+    np.testing.assert_allclose(face['encoding'], encodings.mean(axis=0), atol=1e-5)
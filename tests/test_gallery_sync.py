@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from utils.face_storage import FaceGallery
+from utils.gallery_sync import GallerySync, LocalGalleryBus
+
+
+@pytest.fixture
+def nodes():
+    bus = LocalGalleryBus()
+    galleries = [FaceGallery(), FaceGallery()]
+    syncs = [GallerySync(), GallerySync()]
+    for sync, gallery in zip(syncs, galleries):
+        sync.start(gallery, bus)
+    return galleries, syncs
+
+
+def test_add_propagates_with_all_templates(nodes, make_encodings):
+    (local, remote), (sync, _) = nodes
+    encodings = make_encodings(2)
+    face = local.add_known_face(encodings[0], 'a')
+    local.update_face_encoding(face['id'], encodings[1])
+    sync.publish_added(face)
+
+    replica = remote.get_face_info(face['id'])
+    assert replica['name'] == 'a'
+    assert len(replica['templates']) == 2
+    np.testing.assert_allclose(replica['encoding'], face['encoding'], atol=1e-5)
+
+
+def test_update_and_rename_propagate(nodes, make_encodings):
+    (local, remote), (sync, _) = nodes
+    encodings = make_encodings(2)
+    face = local.add_known_face(encodings[0], 'a')
+    sync.publish_added(face)
+
+    local.update_face_encoding(face['id'], encodings[1])
+    sync.publish_updated(face['id'], encodings[1])
+    local.rename_face(face['id'], 'b')
+    sync.publish_renamed(face['id'], 'b')
+
+    replica = remote.get_face_info(face['id'])
+    assert replica['name'] == 'b'
+    assert len(replica['templates']) == 2
+    assert remote.match_face(encodings[1])['id'] == face['id']
+
+
+def test_own_events_are_ignored(nodes, make_encodings):
+    (local, remote), (sync, _) = nodes
+    face = local.add_known_face(make_encodings(1)[0], 'a')
+    sync.publish_added(face)
+    assert len(local.get_all_faces()) == 1
+    assert len(remote.get_all_faces()) == 1
+
+
+def test_publish_without_bus_is_noop():
+    GallerySync().publish_renamed('id', 'name')
+
+
+def test_late_joining_node_catches_up(make_encodings):
+    bus = LocalGalleryBus()
+    first, second = FaceGallery(), FaceGallery()
+    GallerySync().start(first, bus)
+    encodings = make_encodings(3)
+    face = first.add_known_face(encodings[0], 'a')
+    first.update_face_encoding(face['id'], encodings[1])
+    first.add_known_face(encodings[2], 'b')
+
+    second.add_known_face(encodings[0], 'old', face_id=face['id'])
+    GallerySync().start(second, bus)
+    replica = second.get_face_info(face['id'])
+    assert replica['name'] == 'a'
+    assert len(replica['templates']) == 2
+    assert second.find_face_by_name('b') is not None
+    assert len(second.get_all_faces()) == 2
+    # 新节点的全部条目不会回传给已有节点
+    assert len(first.get_all_faces()) == 2
+
+
+def test_catch_up_from_several_nodes_does_not_duplicate(make_encodings):
+    bus = LocalGalleryBus()
+    galleries = [FaceGallery() for _ in range(3)]
+    for gallery in galleries[:2]:
+        gallery.add_known_face(make_encodings(1)[0], 'a', face_id='x')
+        GallerySync().start(gallery, bus)
+    GallerySync().start(galleries[2], bus)
+    assert len(galleries[2].get_all_faces()) == 1
+    assert len(galleries[2].get_face_info('x')['templates']) == 1
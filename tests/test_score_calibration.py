@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from utils.score_calibration import SCORE_THRESHOLD, calibrate_score, fit_calibration, is_low_confidence
+
+
+def test_default_curve_passes_through_anchor_points():
+    assert calibrate_score(0.6) == pytest.approx(SCORE_THRESHOLD, abs=0.01)
+    assert calibrate_score(1.0) == pytest.approx(0.2, abs=0.01)
+    assert calibrate_score(0.2) > calibrate_score(0.6) > calibrate_score(1.0)
+
+
+def test_fit_recovers_parameters_from_measured_pairs():
+    distances = np.linspace(0.2, 1.4, 50)
+    scores = [calibrate_score(d, slope=4.0, midpoint=0.8) for d in distances]
+    slope, midpoint = fit_calibration(distances, scores)
+    assert slope == pytest.approx(4.0, rel=1e-3)
+    assert midpoint == pytest.approx(0.8, rel=1e-3)
+
+
+def test_low_confidence_band_around_threshold():
+    assert is_low_confidence(SCORE_THRESHOLD)
+    assert not is_low_confidence(0.95)
+    assert not is_low_confidence(0.1)
@@ -0,0 +1,46 @@
+import time
+
+from utils.unknown_faces import UnknownFacePool
+
+
+def test_repeat_sightings_cluster_into_one_identity(make_encodings):
+    pool = UnknownFacePool()
+    encodings = make_encodings(1)
+    first = pool.match_or_add(encodings[0])
+    second = pool.match_or_add(encodings[0] + 0.001)
+    assert first is second
+    assert first['count'] == 2
+    assert len(first['templates']) == 2
+
+
+def test_pool_evicts_least_recently_seen_when_full(make_encodings):
+    pool = UnknownFacePool(max_size=2)
+    encodings = make_encodings(3)
+    first = pool.match_or_add(encodings[0])
+    second = pool.match_or_add(encodings[1])
+    pool.match_or_add(encodings[0])
+    pool.match_or_add(encodings[2])
+    assert first['id'] in pool.faces
+    assert second['id'] not in pool.faces
+
+
+def test_expired_entries_are_evicted_unless_touched(make_encodings):
+    pool = UnknownFacePool(ttl=0.05)
+    encodings = make_encodings(3)
+    kept = pool.match_or_add(encodings[0])
+    expired = pool.match_or_add(encodings[1])
+    time.sleep(0.03)
+    pool.touch([kept['id']])
+    time.sleep(0.03)
+    pool.match_or_add(encodings[2])
+    assert kept['id'] in pool.faces
+    assert expired['id'] not in pool.faces
+
+
+def test_pop_removes_entry(make_encodings):
+    pool = UnknownFacePool()
+    face = pool.match_or_add(make_encodings(1)[0])
+    assert pool.get(face['id']) is face
+    assert pool.pop(face['id']) is face
+    assert pool.get(face['id']) is None
+    assert pool.pop(face['id']) is None
@@ -0,0 +1,58 @@
+import numpy as np
+
+from utils.wire_format import CompactFaceEncoder, pack_face
+
+
+def make_face(face_id, name, location, prob=0.99):
+    return {
+        'id': face_id,
+        'name': name,
+        'location': location,
+        'landmark': [[10.2, 20.7]] * 5,
+        'prob': np.float32(prob)
+    }
+
+
+def test_first_frame_sends_everything():
+    encoder = CompactFaceEncoder()
+    result = encoder.encode([make_face('a', '未知', (1.2, 2.0, 3.0, 4.0))], 100)
+    assert result['ids'] == ['a']
+    assert result['changed'] == b'\x01'
+    assert np.frombuffer(result['boxes'], dtype='<i2').tolist() == [1, 2, 3, 4]
+    assert np.frombuffer(result['landmarks'], dtype='<i2').reshape(-1, 5, 2)[0, 0].tolist() == [10, 21]
+    assert np.frombuffer(result['probs'], dtype='<f2')[0] == np.float16(0.99)
+    assert result['names'] == {'a': '未知'}
+
+
+def test_unchanged_faces_are_sent_as_deltas():
+    encoder = CompactFaceEncoder()
+    faces = [make_face('a', '未知', (1, 2, 3, 4)), make_face('b', '张三', (5, 6, 7, 8))]
+    encoder.encode(faces, 1)
+    faces[1] = make_face('b', '张三', (9, 6, 7, 8))
+    result = encoder.encode(faces, 2)
+    assert result['changed'] == b'\x00\x01'
+    assert np.frombuffer(result['boxes'], dtype='<i2').tolist() == [9, 6, 7, 8]
+    assert result['names'] == {}
+
+
+def test_names_are_resent_on_identity_change_and_reappearance():
+    encoder = CompactFaceEncoder()
+    encoder.encode([make_face('a', '未知', (1, 2, 3, 4))], 1)
+    assert encoder.encode([make_face('a', '李四', (1, 2, 3, 4))], 2)['names'] == {'a': '李四'}
+    encoder.encode([], 3)
+    assert encoder.encode([make_face('a', '李四', (1, 2, 3, 4))], 4)['names'] == {'a': '李四'}
+
+
+def test_ignored_faces_always_send_geometry():
+    encoder = CompactFaceEncoder()
+    faces = [make_face(None, '忽略', (1, 2, 3, 4))]
+    encoder.encode(faces, 1)
+    result = encoder.encode(faces, 2)
+    assert result['changed'] == b'\x01'
+    assert result['names'] == {}
+
+
+def test_pack_face():
+    packed = pack_face((1.4, 2.6, 3, 4), np.full((5, 2), 7.0))
+    assert np.frombuffer(packed['location'], dtype='<i2').tolist() == [1, 3, 3, 4]
+    assert np.frombuffer(packed['landmark'], dtype='<i2').tolist() == [7] * 10
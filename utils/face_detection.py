@@ -6,6 +6,8 @@ from facenet_pytorch import MTCNN
 
 device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 mtcnn = MTCNN(keep_all=True, device=device)
+# 用于区域检测，较大的最小人脸尺寸使图像金字塔只包含少数几层
+roi_mtcnn = MTCNN(keep_all=True, device=device, min_face_size=40)
 
 
 def find_faces(image):
@@ -35,6 +37,84 @@ def find_primary_face(image):
         return None
 
 
+def find_primary_face_in_roi(image, last_box, expand=1.0, target_face_size=80):
+    """
+    在上一帧人脸框周围的区域内查找最显著的人脸。
+
+    将上一帧的人脸框向四周各扩展expand倍宽高作为检测区域，并缩放到人脸约为target_face_size像素，
+    使图像金字塔只覆盖与已知人脸相近的尺度。区域内未检测到人脸时回退到全图检测。
+
+    参数:
+    - image: PIL.Image对象，包含待检测的图像。
+    - last_box: 上一帧的人脸框（x1, y1, x2, y2）。
+
+    返回:
+    - 与find_primary_face相同，坐标为原图坐标。
+    """
+    x1, y1, x2, y2 = last_box
+    width, height = x2 - x1, y2 - y1
+    left = max(0, int(x1 - width * expand))
+    top = max(0, int(y1 - height * expand))
+    right = min(image.width, int(x2 + width * expand))
+    bottom = min(image.height, int(y2 + height * expand))
+    if width <= 0 or height <= 0 or right <= left or bottom <= top:
+        return find_primary_face(image)
+
+    scale = target_face_size / max(width, height)
+    roi = image.crop((left, top, right, bottom))
+    roi = roi.resize((max(1, int(roi.width * scale)), max(1, int(roi.height * scale))))
+    boxes, probs, landmarks = roi_mtcnn.detect(roi, landmarks=True)
+    if boxes is None:
+        return find_primary_face(image)
+
+    # 将区域内的坐标映射回原图
+    box = boxes[0] / scale + np.array([left, top, left, top])
+    landmark = landmarks[0] / scale + np.array([left, top])
+    return box, probs[0], landmark
+
+
+def find_primary_faces(images, pad=False):
+    """
+    批量查找多张图像中最显著的人脸。
+
+    MTCNN只能对尺寸相同的图像进行批量检测。pad为True时，把所有图像贴到同一尺寸画布的左上角后一次检测，
+    画布取这批图像的最大宽高，坐标与原图一致；否则按尺寸分组后逐组检测。
+    尺寸各不相同的照片（例如批量注册）应使用pad，否则每组只有一张图像，退化为逐张检测。
+
+    参数:
+    - images: PIL.Image对象列表。
+    - pad: 是否填充到相同尺寸后统一检测。
+
+    返回:
+    - 与images一一对应的列表，每项为(框, 置信度, 关键点)，未检测到人脸时为None。
+    """
+    results = [None] * len(images)
+    if not images:
+        return results
+    if pad:
+        canvas_size = (max(image.width for image in images), max(image.height for image in images))
+        padded_images = []
+        for image in images:
+            if image.size == canvas_size:
+                padded_images.append(image)
+            else:
+                canvas = Image.new('RGB', canvas_size)
+                canvas.paste(image, (0, 0))
+                padded_images.append(canvas)
+        groups = {canvas_size: list(range(len(images)))}
+        images = padded_images
+    else:
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.size, []).append(i)
+    for indices in groups.values():
+        batch_boxes, batch_probs, batch_landmarks = mtcnn.detect([images[i] for i in indices], landmarks=True)
+        for i, boxes, probs, landmarks in zip(indices, batch_boxes, batch_probs, batch_landmarks):
+            if boxes is not None:
+                results[i] = (boxes[0], probs[0], landmarks[0])
+    return results
+
+
 def align_face(image, box, landmark):
     # 计算两眼之间的角度
     eye_left = np.array(landmark[0])
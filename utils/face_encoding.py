@@ -1,18 +1,29 @@
+import numpy as np
 import torch
 from facenet_pytorch import InceptionResnetV1
 from torchvision import transforms
 
 device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 resnet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
+preprocess = transforms.Compose([
+    transforms.Resize((160, 160)),
+    transforms.ToTensor(),
+])
 
 
 def encode_face(face_image):
     """Encode a face image into a high-dimensional vector."""
-    preprocess = transforms.Compose([
-        transforms.Resize((160, 160)),
-        transforms.ToTensor(),
-    ])
     face_tensor = preprocess(face_image).unsqueeze(0)
     with torch.no_grad():
         face_encoding = resnet(face_tensor)
     return face_encoding.detach().cpu().numpy()[0]
+
+
+def encode_faces(face_images):
+    """Encode a batch of face images in a single forward pass."""
+    if not face_images:
+        return np.empty((0, 512), dtype=np.float32)
+    face_tensor = torch.stack([preprocess(face_image) for face_image in face_images]).to(device)
+    with torch.no_grad():
+        face_encodings = resnet(face_tensor)
+    return face_encodings.detach().cpu().numpy()
@@ -0,0 +1,173 @@
+import atexit
+import heapq
+import multiprocessing
+import os
+import threading
+import uuid
+import zlib
+
+from utils.face_storage import FaceGallery, SingletonMeta
+
+
+def _get_context():
+    # 优先使用fork，避免子进程重新导入主模块并加载检测和编码模型
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context('spawn')
+
+
+def _shard_worker(conn):
+    """分片进程的主循环：接收(方法名, 参数)并在本分片的人脸库上执行"""
+    gallery = FaceGallery()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        method, args, kwargs = message
+        try:
+            conn.send((True, getattr(gallery, method)(*args, **kwargs)))
+        except Exception as e:
+            conn.send((False, e))
+    conn.close()
+
+
+class _Shard:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_shard_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+
+    def send(self, method, *args, **kwargs):
+        self.conn.send((method, args, kwargs))
+
+    def recv_raw(self):
+        """接收一条(是否成功, 结果或异常)形式的回复"""
+        return self.conn.recv()
+
+    def recv(self):
+        ok, result = self.recv_raw()
+        if not ok:
+            raise result
+        return result
+
+    def call(self, method, *args, **kwargs):
+        with self.lock:
+            self.send(method, *args, **kwargs)
+            return self.recv()
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.conn.close()
+        self.process.join(timeout=1)
+
+
+class ShardedFaceStorage(metaclass=SingletonMeta):
+    """
+    分片人脸库。
+
+    人脸按ID划分到多个分片进程中，查询时把编码广播到所有分片，
+    各分片并行返回本地的前k个结果后在当前进程中合并；
+    添加、更新和重命名只发送到该ID所属的分片。
+    接口与FaceStorage保持一致，但有两点不同：
+
+    - 返回的人脸条目是分片中条目的副本，修改它们不会影响人脸库，之后的重命名等变更也不会反映到已返回的副本上，
+      调用方需要按ID重新查询或自行同步（见services.recognition.rename_face）。
+    - 广播查询期间持有所有分片的锁，单次查询在各分片间并行，但并发的查询之间是串行的，
+      吞吐量受分片数而不是调用线程数限制。
+    """
+
+    def __init__(self, num_shards=None):
+        if num_shards is None:
+            num_shards = os.cpu_count() or 1
+        context = _get_context()
+        self.shards = [_Shard(context) for _ in range(num_shards)]
+        atexit.register(self.close)
+
+    def _owner_index(self, face_id):
+        # 使用稳定的哈希，保证同一ID在任何进程中都路由到同一分片
+        return zlib.crc32(str(face_id).encode('utf-8')) % len(self.shards)
+
+    def _owner(self, face_id):
+        return self.shards[self._owner_index(face_id)]
+
+    def _broadcast(self, method, *args, **kwargs):
+        # 按固定顺序加锁，先全部发送再依次接收，使各分片并行计算
+        for shard in self.shards:
+            shard.lock.acquire()
+        try:
+            for shard in self.shards:
+                shard.send(method, *args, **kwargs)
+            # 先读取全部分片的回复再抛出异常，避免未读的回复留在管道中被后续调用读到
+            replies = [shard.recv_raw() for shard in self.shards]
+            for ok, result in replies:
+                if not ok:
+                    raise result
+            return [result for _, result in replies]
+        finally:
+            for shard in self.shards:
+                shard.lock.release()
+
+    def add_known_face(self, face_encoding, name, face_id=None):
+        """将新的人脸编码和名称添加到其所属的分片中"""
+        if face_id is None:
+            face_id = str(uuid.uuid4())
+        return self._owner(face_id).call('add_known_face', face_encoding, name, face_id=face_id)
+
+    def add_faces(self, faces):
+        """批量添加完整的人脸条目，按所属分片分组后发送"""
+        groups = {}
+        for face in faces:
+            groups.setdefault(self._owner_index(face["id"]), []).append(face)
+        for index, shard_faces in groups.items():
+            self.shards[index].call('add_faces', shard_faces)
+
+    def get_all_faces(self):
+        """获取所有分片中的人脸条目"""
+        return [face for shard_faces in self._broadcast('get_all_faces') for face in shard_faces]
+
+    def search_faces(self, face_encoding, k=1):
+        """在所有分片中查找距离最近的k个人脸"""
+        results = self._broadcast('search_faces', face_encoding, k=k)
+        return heapq.nsmallest(k, (item for shard_results in results for item in shard_results),
+                               key=lambda item: item[0])
+
+    def match_face(self, face_encoding, tolerance=0.6):
+        """在已知的人脸编码中寻找匹配项"""
+        results = self.search_faces(face_encoding, k=1)
+        if results and results[0][0] < tolerance:
+            return results[0][1]
+        return None
+
+    def update_face_encoding(self, face_id, new_encoding):
+        """根据人脸ID为该身份添加或替换一个模板"""
+        return self._owner(face_id).call('update_face_encoding', face_id, new_encoding)
+
+    def rename_face(self, face_id, new_name):
+        """根据人脸ID更新人脸名称"""
+        return self._owner(face_id).call('rename_face', face_id, new_name)
+
+    def get_face_info(self, face_id):
+        """根据人脸ID获取人脸信息"""
+        return self._owner(face_id).call('get_face_info', face_id)
+
+    def find_face_by_name(self, name):
+        """根据名称获取人脸信息"""
+        for face in self._broadcast('find_face_by_name', name):
+            if face is not None:
+                return face
+        return None
+
+    def close(self):
+        """关闭所有分片进程"""
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
@@ -1,7 +1,14 @@
+import multiprocessing
+import os
 import uuid
 
 import numpy as np
 
+# 分片进程数，0表示在当前进程中保存全部人脸库
+FACE_STORAGE_SHARDS = int(os.environ.get('FACE_STORAGE_SHARDS', 0))
+# 人脸库文件路径，服务启动时从此文件加载
+FACE_GALLERY_PATH = os.environ.get('FACE_GALLERY_PATH', 'gallery.npz')
+
 
 class SingletonMeta(type):
     _instances = {}
@@ -13,50 +20,211 @@ class SingletonMeta(type):
         return cls._instances[cls]
 
 
-class FaceStorage(metaclass=SingletonMeta):
-    def __init__(self):
+class FaceGallery:
+    """
+    单个进程内的人脸库，FaceStorage和各个分片进程共用这一实现。
+
+    每个身份最多保存max_templates个人脸编码模板，并维护模板的质心（即"encoding"字段）。
+    与已有模板距离低于duplicate_tolerance的编码视为重复，不会作为新模板加入。
+    查询时先用质心筛选候选身份，再与候选身份的全部模板比对。
+    """
+
+    def __init__(self, max_templates=5, prefilter_candidates=8, duplicate_tolerance=0.1):
         self.known_faces = []  # 存储已知人脸的信息，每个条目是一个字典
+        self.max_templates = max_templates
+        self.prefilter_candidates = prefilter_candidates
+        self.duplicate_tolerance = duplicate_tolerance
+        self._index = {}  # 人脸ID到known_faces下标的映射
+        self._name_index = {}  # 名称到人脸ID列表的映射
+        self._centroids = None  # 质心矩阵，为None时在下次查询前重建
 
-    def add_known_face(self, face_encoding, name):
+    def add_known_face(self, face_encoding, name, face_id=None):
         """将新的人脸编码和名称添加到存储中"""
-        face_id = str(uuid.uuid4())  # 生成唯一标识符
+        if face_id is None:
+            face_id = str(uuid.uuid4())  # 生成唯一标识符
         face = {
             "id": face_id,
             "name": name,
-            "encoding": face_encoding
+            "encoding": np.array(face_encoding, dtype=np.float32),
+            "templates": [face_encoding]
         }
+        self._index[face_id] = len(self.known_faces)
+        self._name_index.setdefault(name, []).append(face_id)
         self.known_faces.append(face)
+        self._centroids = None
         return face
 
+    def add_faces(self, faces):
+        """批量添加完整的人脸条目（包含ID、名称、质心和模板）"""
+        for face in faces:
+            self._index[face["id"]] = len(self.known_faces)
+            self._name_index.setdefault(face["name"], []).append(face["id"])
+            self.known_faces.append(face)
+        self._centroids = None
+
+    def get_all_faces(self):
+        """获取所有人脸条目"""
+        return self.known_faces
+
+    def _get_centroids(self):
+        if self._centroids is None:
+            self._centroids = np.array([face["encoding"] for face in self.known_faces])
+        return self._centroids
+
+    def search_faces(self, face_encoding, k=1):
+        """返回距离最近的k个人脸，结果为按距离升序排列的(距离, 人脸)列表"""
+        if not self.known_faces:
+            return []
+        # 先用质心筛选候选身份
+        centroid_distances = np.linalg.norm(self._get_centroids() - face_encoding, axis=1)
+        num_candidates = min(k + self.prefilter_candidates, len(centroid_distances))
+        candidates = np.argpartition(centroid_distances, num_candidates - 1)[:num_candidates]
+
+        # 再以候选身份中距离最近的模板作为该身份的距离
+        results = []
+        for i in candidates:
+            face = self.known_faces[i]
+            distance = np.linalg.norm(np.asarray(face["templates"]) - face_encoding, axis=1).min()
+            results.append((float(distance), face))
+        results.sort(key=lambda item: item[0])
+        return results[:k]
+
     def match_face(self, face_encoding, tolerance=0.6):
         """在已知的人脸编码中寻找匹配项"""
-        if not self.known_faces:
-            return None
-        distances = np.linalg.norm([face["encoding"] for face in self.known_faces] - face_encoding, axis=1)
-        best_match_index = np.argmin(distances)
-        if distances[best_match_index] < tolerance:
-            return self.known_faces[best_match_index]
+        results = self.search_faces(face_encoding, k=1)
+        if results and results[0][0] < tolerance:
+            return results[0][1]
         return None
 
     def update_face_encoding(self, face_id, new_encoding):
-        """根据人脸ID更新人脸编码"""
-        for face in self.known_faces:
-            if face["id"] == face_id:
-                face["encoding"] = new_encoding
-                return True
-        return False
+        """
+        根据人脸ID为该身份添加一个模板。
+
+        模板数量已达上限时，替换离质心最远的模板，并增量更新质心。
+        与已有模板几乎相同的编码直接忽略，例如同一帧的缓存编码被多次提交时，
+        重复的模板不增加信息，还会挤掉其他光照下的模板。
+        """
+        face = self.get_face_info(face_id)
+        if face is None:
+            return False
+        templates = face["templates"]
+        if np.linalg.norm(np.asarray(templates) - new_encoding, axis=1).min() < self.duplicate_tolerance:
+            return True
+        centroid = face["encoding"]
+        if len(templates) < self.max_templates:
+            templates.append(new_encoding)
+            centroid += (new_encoding - centroid) / len(templates)
+        else:
+            worst = int(np.argmax(np.linalg.norm(np.asarray(templates) - centroid, axis=1)))
+            centroid += (new_encoding - templates[worst]) / len(templates)
+            templates[worst] = new_encoding
+        if self._centroids is not None:
+            self._centroids[self._index[face_id]] = centroid
+        return True
 
     def rename_face(self, face_id, new_name):
         """根据人脸ID更新人脸名称"""
-        for face in self.known_faces:
-            if face["id"] == face_id:
-                face["name"] = new_name
-                return True
-        return False
+        face = self.get_face_info(face_id)
+        if face is None:
+            return False
+        face_ids = self._name_index[face["name"]]
+        face_ids.remove(face_id)
+        if not face_ids:
+            del self._name_index[face["name"]]
+        self._name_index.setdefault(new_name, []).append(face_id)
+        face["name"] = new_name
+        return True
 
     def get_face_info(self, face_id):
         """根据人脸ID获取人脸信息"""
-        for face in self.known_faces:
-            if face["id"] == face_id:
-                return face
-        return None
+        index = self._index.get(face_id)
+        if index is None:
+            return None
+        return self.known_faces[index]
+
+    def find_face_by_name(self, name):
+        """根据名称获取人脸信息"""
+        face_ids = self._name_index.get(name)
+        if not face_ids:
+            return None
+        return self.get_face_info(face_ids[0])
+
+
+def resolve_enrollment(galleries, face_encoding, name, tolerance=0.6, enroll_tolerance=0.9):
+    """
+    决定一个新的人脸编码应如何加入人脸库，注册和批量注册共用这一规则。
+
+    依次在galleries中查找匹配的人脸：匹配到同名身份时作为其模板加入，匹配到其他身份时拒绝。
+    未匹配时查找同名身份，与其已有模板的距离低于enroll_tolerance时作为模板加入，否则拒绝。
+
+    返回:
+    - (gallery, face, message)：face不为None时应调用gallery.update_face_encoding为其添加模板；
+      message不为None时拒绝注册；两者都为None时应新建身份。
+    """
+    for gallery in galleries:
+        matched_face = gallery.match_face(face_encoding, tolerance=tolerance)
+        if matched_face is not None:
+            if matched_face["name"] == name:
+                return gallery, matched_face, None
+            return None, None, "人脸已注册"
+
+    for gallery in galleries:
+        existing_face = gallery.find_face_by_name(name)
+        if existing_face is not None:
+            # 同一用户在不同光照下注册时，可能与已有模板距离较远但仍属于同一人
+            distance = np.linalg.norm(np.asarray(existing_face["templates"]) - face_encoding, axis=1).min()
+            if distance < enroll_tolerance:
+                return gallery, existing_face, None
+            return None, None, "用户名已被注册"
+    return None, None, None
+
+
+def save_gallery(storage, path):
+    """
+    将人脸库保存为npz文件，先写临时文件再替换，避免中断时留下损坏的文件。
+
+    文件中只包含数值和字符串数组，加载时不需要反序列化任意对象。
+    """
+    faces = storage.get_all_faces()
+    templates = [np.asarray(template, dtype=np.float32) for face in faces for template in face["templates"]]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f,
+                 ids=np.array([face["id"] for face in faces], dtype=str),
+                 names=np.array([face["name"] for face in faces], dtype=str),
+                 centroids=np.array([face["encoding"] for face in faces], dtype=np.float32),
+                 template_counts=np.array([len(face["templates"]) for face in faces], dtype=np.int64),
+                 templates=np.array(templates, dtype=np.float32))
+    os.replace(tmp_path, path)
+
+
+def load_gallery(storage, path):
+    """从save_gallery保存的文件加载人脸条目到人脸库中"""
+    with np.load(path, allow_pickle=False) as data:
+        ids, names = data["ids"], data["names"]
+        centroids, templates = data["centroids"], data["templates"]
+        offsets = np.concatenate([[0], np.cumsum(data["template_counts"])])
+    faces = [{
+        "id": str(ids[i]),
+        "name": str(names[i]),
+        "encoding": centroids[i].copy(),
+        "templates": list(templates[offsets[i]:offsets[i + 1]])
+    } for i in range(len(ids))]
+    storage.add_faces(faces)
+
+
+class FaceStorage(FaceGallery, metaclass=SingletonMeta):
+    pass
+
+
+def get_face_storage():
+    """
+    获取当前进程使用的人脸库。
+
+    设置了FACE_STORAGE_SHARDS时返回分片人脸库，否则返回进程内的FaceStorage单例。
+    """
+    # 分片进程自身不再创建分片
+    if FACE_STORAGE_SHARDS > 0 and multiprocessing.parent_process() is None:
+        from utils.face_shards import ShardedFaceStorage
+        return ShardedFaceStorage(FACE_STORAGE_SHARDS)
+    return FaceStorage()
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from utils.face_detection import align_face
+from utils.face_encoding import encode_face
+from utils.face_quality import evaluate_face_quality
+
+
+class CachedFrame:
+    """预览帧的解码结果和检测结果，人脸编码在第一次使用时才计算"""
+
+    def __init__(self, image, primary_face, is_forward):
+        self.image = image
+        self.primary_face = primary_face
+        self.is_forward = is_forward
+        self.created_at = time.monotonic()
+        self._encoding = None
+        self._lock = threading.Lock()
+
+    def get_encoding(self):
+        """
+        获取该帧中人脸的编码。
+
+        返回:
+        - 人脸编码；人脸非正脸或未通过质量检查时返回None。
+        """
+        if not self.is_forward:
+            return None
+        with self._lock:
+            if self._encoding is None:
+                box, prob, landmark = self.primary_face
+                if not evaluate_face_quality(box, prob, self.image, landmark):
+                    return None
+                self._encoding = encode_face(align_face(self.image, box, landmark))
+            return self._encoding
+
+
+class FrameCache:
+    """按连接（request.sid）保存最近一帧预览结果的短时缓存"""
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def put(self, sid, cached_frame):
+        with self._lock:
+            self._frames[sid] = cached_frame
+
+    def get(self, sid):
+        """获取该连接最近一帧的结果，超过ttl秒的结果视为过期"""
+        with self._lock:
+            cached_frame = self._frames.get(sid)
+            if cached_frame is None:
+                return None
+            if time.monotonic() - cached_frame.created_at > self.ttl:
+                del self._frames[sid]
+                return None
+            return cached_frame
+
+    def pop(self, sid):
+        with self._lock:
+            return self._frames.pop(sid, None)
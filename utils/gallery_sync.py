@@ -0,0 +1,164 @@
+import json
+import logging
+import time
+import uuid
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LocalGalleryBus:
+    """进程内的消息总线，用于测试和单进程部署"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def publish(self, event):
+        message = json.dumps(event)
+        for callback in list(self.callbacks):
+            callback(json.loads(message))
+
+    def listen(self, callback, on_ready=None):
+        self.callbacks.append(callback)
+        if on_ready is not None:
+            on_ready()
+
+
+class KombuGalleryBus:
+    """
+    基于kombu fanout交换机的消息总线，可与Flask-SocketIO的消息队列共用同一个broker（redis://、amqp://等）。
+
+    发布时最多重试publish_retries次，broker不可用时抛出异常而不是无限等待；
+    监听在连接断开后每隔reconnect_interval秒重连。
+    """
+
+    def __init__(self, url, exchange_name='face-gallery', publish_retries=3, reconnect_interval=5.0):
+        import kombu
+
+        self.kombu = kombu
+        self.connection = kombu.Connection(url)
+        self.exchange = kombu.Exchange(exchange_name, type='fanout', durable=False)
+        self.retry_policy = {'max_retries': publish_retries, 'interval_start': 0, 'interval_step': 1,
+                             'interval_max': 1}
+        self.reconnect_interval = reconnect_interval
+
+    def publish(self, event):
+        with self.connection.clone() as connection:
+            producer = connection.Producer()
+            producer.publish(event, exchange=self.exchange, declare=[self.exchange], serializer='json', retry=True,
+                             retry_policy=self.retry_policy)
+
+    def listen(self, callback, on_ready=None):
+        """
+        阻塞地接收消息，应在后台任务中调用。
+
+        每次连接（包括重连）成功后调用on_ready；单条消息处理失败时记录日志并继续接收。
+        """
+
+        def on_message(body, message):
+            try:
+                callback(body)
+            except Exception:
+                logger.exception("应用人脸库变更失败: %s", body.get('op'))
+            message.ack()
+
+        while True:
+            try:
+                with self.connection.clone() as connection:
+                    connection.ensure_connection(interval_start=self.reconnect_interval,
+                                                 interval_max=self.reconnect_interval)
+                    queue = self.kombu.Queue(exchange=self.exchange, exclusive=True, auto_delete=True)
+                    with connection.Consumer(queue, callbacks=[on_message], accept=['json']):
+                        if on_ready is not None:
+                            on_ready()
+                        while True:
+                            connection.drain_events()
+            except Exception:
+                logger.exception("人脸库同步连接断开，%s秒后重连", self.reconnect_interval)
+                time.sleep(self.reconnect_interval)
+
+
+class GallerySync:
+    """
+    在多个服务节点之间同步人脸库的变更。
+
+    注册、添加模板和重命名后，服务层调用publish_*方法把变更广播给其他节点，
+    其他节点收到后应用到本地人脸库。未调用start时publish_*不做任何事。
+
+    节点开始监听（以及断线重连）后会广播同步请求，其他节点把各自的全部人脸条目发给它，
+    因此重启或后加入的节点能补上启动前的变更。已有的条目按ID合并，重复的模板会被忽略，
+    所以多个节点同时应答也不会产生重复数据。
+    变更只保存在运行中节点的内存里，不会写回FACE_GALLERY_PATH：所有节点同时重启时，
+    上次保存人脸库文件之后的变更会丢失，需要定期用save_gallery保存。
+    """
+
+    def __init__(self):
+        self.node_id = str(uuid.uuid4())
+        self.bus = None
+        self.storage = None
+
+    def start(self, storage, bus, start_background_task=None):
+        """
+        开始同步。
+
+        参数:
+        - storage: 本节点的人脸库。
+        - bus: 消息总线，LocalGalleryBus或KombuGalleryBus。
+        - start_background_task: 启动后台任务的函数，例如socketio.start_background_task；
+                                 bus.listen不阻塞时可以为None。
+        """
+        self.storage = storage
+        self.bus = bus
+        if start_background_task is None:
+            bus.listen(self._apply, self.request_sync)
+        else:
+            start_background_task(bus.listen, self._apply, self.request_sync)
+
+    def _publish(self, event):
+        if self.bus is not None:
+            event['node'] = self.node_id
+            try:
+                self.bus.publish(event)
+            except Exception:
+                # 本地的变更已经生效，其他节点会在重连后的同步请求中补上
+                logger.exception("广播人脸库变更失败: %s", event['op'])
+
+    def request_sync(self):
+        """请求其他节点发送全部人脸条目"""
+        self._publish({'op': 'sync_request'})
+
+    def publish_added(self, face, to=None):
+        self._publish({'op': 'add', 'id': face['id'], 'name': face['name'], 'to': to,
+                       'templates': [np.asarray(template).tolist() for template in face['templates']]})
+
+    def publish_updated(self, face_id, face_encoding):
+        self._publish({'op': 'update', 'id': face_id, 'encoding': np.asarray(face_encoding).tolist()})
+
+    def publish_renamed(self, face_id, name):
+        self._publish({'op': 'rename', 'id': face_id, 'name': name})
+
+    def _apply(self, event):
+        # 忽略本节点自己发出的变更和发给其他节点的条目
+        if event.get('node') == self.node_id or event.get('to') not in (None, self.node_id):
+            return
+        op = event['op']
+        if op == 'sync_request':
+            for face in self.storage.get_all_faces():
+                self.publish_added(face, to=event['node'])
+        elif op == 'add':
+            templates = [np.array(template, dtype=np.float32) for template in event['templates']]
+            face = self.storage.get_face_info(event['id'])
+            if face is None:
+                self.storage.add_known_face(templates[0], event['name'], face_id=event['id'])
+            elif face['name'] != event['name']:
+                self.storage.rename_face(event['id'], event['name'])
+            for template in templates[1:] if face is None else templates:
+                self.storage.update_face_encoding(event['id'], template)
+        elif op == 'update':
+            self.storage.update_face_encoding(event['id'], np.array(event['encoding'], dtype=np.float32))
+        elif op == 'rename':
+            self.storage.rename_face(event['id'], event['name'])
+
+
+gallery_sync = GallerySync()
@@ -11,9 +11,16 @@ def cv2_to_pil(image):
     return Image.fromarray(image)
 
 
+def decode_image_bytes(image_bytes):
+    """Decode an encoded image (PNG, JPEG, ...) into PIL format, or None if it cannot be decoded."""
+    frame = np.frombuffer(image_bytes, dtype=np.uint8)
+    frame = cv2.imdecode(frame, flags=1)
+    if frame is None:
+        return None
+    return cv2_to_pil(frame)
+
+
 def parse_frame_data(frame_data):
     """Parse frame data from base64 encoding."""
     frame_data = base64.b64decode(frame_data.split(',')[1])
-    frame = np.frombuffer(frame_data, dtype=np.uint8)
-    frame = cv2.imdecode(frame, flags=1)
-    return cv2_to_pil(frame)
+    return decode_image_bytes(frame_data)
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+# 讯飞人脸比对建议的判定阈值
+SCORE_THRESHOLD = 0.67
+# 将编码距离映射为0-1相似度分数的logistic曲线参数：score = 1 / (1 + exp(slope * (distance - midpoint)))。
+# 默认值没有经过实测数据拟合，只是让曲线经过两个选定的点：距离0.6（本地匹配阈值）对应0.67（讯飞建议阈值），
+# 距离1.0对应0.2。得到一批图像对的本地距离和讯飞分数后，应使用fit_calibration拟合，
+# 并通过环境变量FACE_COMPARE_SCORE_SLOPE和FACE_COMPARE_SCORE_MIDPOINT设置。
+SCORE_SLOPE = float(os.environ.get('FACE_COMPARE_SCORE_SLOPE', 5.24))
+SCORE_MIDPOINT = float(os.environ.get('FACE_COMPARE_SCORE_MIDPOINT', 0.735))
+
+
+def calibrate_score(distance, slope=None, midpoint=None):
+    """将两个人脸编码之间的欧氏距离转换为相似度分数"""
+    slope = SCORE_SLOPE if slope is None else slope
+    midpoint = SCORE_MIDPOINT if midpoint is None else midpoint
+    return float(1 / (1 + np.exp(slope * (distance - midpoint))))
+
+
+def is_low_confidence(score, margin=0.1):
+    """分数接近判定阈值时认为本地结果不够可靠"""
+    return abs(score - SCORE_THRESHOLD) < margin
+
+
+def fit_calibration(distances, scores, eps=1e-3):
+    """
+    根据实测的图像对拟合calibrate_score的参数。
+
+    参数:
+    - distances: 每对图像的本地编码距离。
+    - scores: 同一批图像对的讯飞比对分数。
+
+    返回:
+    - (slope, midpoint)。
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    scores = np.clip(np.asarray(scores, dtype=np.float64), eps, 1 - eps)
+    # logit(score) = -slope * distance + slope * midpoint，对其做最小二乘直线拟合
+    logits = np.log(scores / (1 - scores))
+    a, b = np.polyfit(distances, logits, 1)
+    slope = -a
+    return float(slope), float(b / slope)
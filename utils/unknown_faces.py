@@ -0,0 +1,84 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+class UnknownFacePool:
+    """
+    未知人脸池。
+
+    未匹配到人脸库的人脸保存在这里而不是人脸库中：同一人的多次出现聚类为一个临时身份，
+    池的大小有上限，长时间未出现的身份按TTL淘汰，池满时淘汰最久未出现的身份。
+    临时身份被重命名后才转入人脸库。
+    """
+
+    def __init__(self, max_size=200, ttl=300.0, tolerance=0.6, max_templates=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self.max_templates = max_templates
+        self.faces = OrderedDict()  # 人脸ID -> 临时身份，按最近出现时间排序
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now):
+        while self.faces:
+            face = next(iter(self.faces.values()))
+            if now - face["last_seen"] <= self.ttl:
+                break
+            self.faces.popitem(last=False)
+
+    def match_or_add(self, face_encoding):
+        """将人脸归入最接近的临时身份，没有足够接近的身份时新建一个"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            if self.faces:
+                faces = list(self.faces.values())
+                distances = np.linalg.norm([face["encoding"] for face in faces] - face_encoding, axis=1)
+                best_match_index = np.argmin(distances)
+                if distances[best_match_index] < self.tolerance:
+                    face = faces[best_match_index]
+                    face["count"] += 1
+                    face["encoding"] = face["encoding"] + (face_encoding - face["encoding"]) / face["count"]
+                    if len(face["templates"]) < self.max_templates:
+                        face["templates"].append(face_encoding)
+                    face["last_seen"] = now
+                    self.faces.move_to_end(face["id"])
+                    return face
+
+            face_id = str(uuid.uuid4())
+            face = {
+                "id": face_id,
+                "name": "未知",
+                "encoding": face_encoding,
+                "templates": [face_encoding],
+                "count": 1,
+                "last_seen": now
+            }
+            self.faces[face_id] = face
+            if len(self.faces) > self.max_size:
+                self.faces.popitem(last=False)
+            return face
+
+    def touch(self, face_ids):
+        """刷新仍在画面中的临时身份的最近出现时间，避免其在显示期间被TTL淘汰"""
+        now = time.monotonic()
+        with self._lock:
+            for face_id in face_ids:
+                face = self.faces.get(face_id)
+                if face is not None:
+                    face["last_seen"] = now
+                    self.faces.move_to_end(face_id)
+
+    def get(self, face_id):
+        """返回临时身份，不存在时返回None"""
+        with self._lock:
+            return self.faces.get(face_id)
+
+    def pop(self, face_id):
+        """从池中移除并返回临时身份，不存在时返回None"""
+        with self._lock:
+            return self.faces.pop(face_id, None)
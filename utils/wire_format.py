@@ -0,0 +1,79 @@
+import numpy as np
+
+
+def pack_face(location, landmark):
+    """
+    detection_result事件的紧凑编码：将单个人脸的位置和关键点打包为小端int16二进制数据。
+
+    返回:
+    - location: 形状(4,)，顺序为(top, right, bottom, left)。
+    - landmark: 形状(5, 2)。
+    """
+    return {
+        'location': np.rint(location).astype('<i2').tobytes(),
+        'landmark': np.rint(landmark).astype('<i2').tobytes()
+    }
+
+
+class CompactFaceEncoder:
+    """
+    detection_results事件的紧凑二进制编码，每个连接使用一个编码器实例。
+
+    编码结果中的字段:
+    - timestamp: 帧的时间戳。
+    - ids: 每个人脸的ID，被忽略的人脸为None。
+    - changed: uint8数组，每个人脸一个字节，1表示本帧发送了该人脸的位置数据，
+               0表示与上一帧相同，客户端沿用上一帧的数据。
+    - boxes: changed为1的人脸的位置，int16数组，形状(M, 4)，顺序为(top, right, bottom, left)。
+    - landmarks: changed为1的人脸的关键点，int16数组，形状(M, 5, 2)。
+    - probs: changed为1的人脸的置信度，float16数组，形状(M,)。
+    - names: 仅包含本帧新出现或名称发生变化的人脸，{ID: 名称}。
+    所有数组均为小端字节序，作为二进制附件发送。
+    """
+
+    def __init__(self):
+        self.last_names = {}  # 人脸ID -> 上一次发送的名称
+        self.last_geometry = {}  # 人脸ID -> 上一帧发送的(位置, 关键点)字节
+
+    def encode(self, faces, timestamp):
+        ids = []
+        changed = np.zeros(len(faces), dtype=np.uint8)
+        boxes = []
+        landmarks = []
+        probs = []
+        names = {}
+        names_seen = {}
+        geometry_seen = {}
+
+        for i, face in enumerate(faces):
+            face_id = face['id']
+            ids.append(face_id)
+            box = np.rint(face['location']).astype('<i2')
+            landmark = np.rint(face['landmark']).astype('<i2')
+            geometry = (box.tobytes(), landmark.tobytes())
+
+            if face_id is None or self.last_geometry.get(face_id) != geometry:
+                changed[i] = 1
+                boxes.append(box)
+                landmarks.append(landmark)
+                probs.append(face['prob'])
+
+            if face_id is not None:
+                if self.last_names.get(face_id) != face['name']:
+                    names[face_id] = face['name']
+                names_seen[face_id] = face['name']
+                geometry_seen[face_id] = geometry
+
+        # 只保留当前帧中出现的人脸，重新出现时会再次发送名称和位置
+        self.last_names = names_seen
+        self.last_geometry = geometry_seen
+
+        return {
+            'timestamp': timestamp,
+            'ids': ids,
+            'changed': changed.tobytes(),
+            'boxes': np.array(boxes, dtype='<i2').reshape(-1, 4).tobytes(),
+            'landmarks': np.array(landmarks, dtype='<i2').reshape(-1, 5, 2).tobytes(),
+            'probs': np.array(probs, dtype='<f2').tobytes(),
+            'names': names
+        }